@@ -2,9 +2,77 @@
 # -------------------------
 # FOOD ANALYZE (OpenAI Vision)
 # -------------------------
-import openai
-from PIL import Image
 import io
+import re
+import math
+import time
+import asyncio
+import heapq
+import itertools
+import uuid
+from collections import OrderedDict
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Tuple
+from fastapi import Request
+from pymongo import UpdateOne
+
+from fastapi.responses import JSONResponse
+
+# orjson is optional: hot endpoints fall back to the standard JSON response without it
+try:
+    import orjson
+
+    class FastJSONResponse(JSONResponse):
+        def render(self, content: Any) -> bytes:
+            return orjson.dumps(content)
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+_food_analyze_import_started = time.perf_counter()
+
+# Heavy vision dependencies are imported on first analyze use (or by the warm-up task)
+openai = None
+Image = None
+_openai_client = None
+
+# Phase -> milliseconds, reported by /api/debug/startup-report
+startup_timings: Dict[str, float] = {}
+
+def load_pillow() -> None:
+    global Image
+    if Image is None:
+        from PIL import Image as image_module
+        Image = image_module
+
+def load_vision_deps() -> None:
+    """Import openai and Pillow on first use so they don't slow down cold starts."""
+    global openai
+    load_pillow()
+    if openai is None:
+        import openai as openai_module
+        openai = openai_module
+
+def get_openai_client():
+    """Shared AsyncOpenAI client so its HTTP connection pool is reused across requests."""
+    global _openai_client
+    load_vision_deps()
+    if _openai_client is None:
+        _openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+# Near-duplicate matching against a user's recently confirmed meals (dHash + Hamming distance)
+MEAL_HASH_ENABLED = os.getenv("MEAL_HASH_ENABLED", "true").lower() == "true"
+MEAL_HASH_MAX_DISTANCE = int(os.getenv("MEAL_HASH_MAX_DISTANCE", "6"))
+MEAL_HASH_MAX_PER_USER = int(os.getenv("MEAL_HASH_MAX_PER_USER", "50"))
+MEAL_HASH_PENDING_MAX = int(os.getenv("MEAL_HASH_PENDING_MAX", "2000"))  # in-memory only when MongoDB is unavailable
+MEAL_HASH_PENDING_TTL_S = int(os.getenv("MEAL_HASH_PENDING_TTL_S", "86400"))  # how long an analysis can still be confirmed
+MEAL_HASH_MAX_USERS = int(os.getenv("MEAL_HASH_MAX_USERS", "1000"))  # per-worker LRU of loaded users
+
+# Background warm-up after the server starts listening
+VISION_WARMUP = os.getenv("VISION_WARMUP", "true").lower() == "true"
+VISION_WARMUP_DELAY_S = float(os.getenv("VISION_WARMUP_DELAY_S", "2"))
 
 # Read OpenAI API Key (OPENAI_KEY or OPENAI_API_KEY)
 OPENAI_API_KEY = os.getenv("OPENAI_KEY", "").strip() or os.getenv("OPENAI_API_KEY", "").strip()
@@ -13,6 +81,52 @@ OPENAI_API_KEY = os.getenv("OPENAI_KEY", "").strip() or os.getenv("OPENAI_API_KE
 VISION_MODEL_PRIMARY = "gpt-4o-mini"  # Cost-effective for food analysis
 VISION_MODEL_FALLBACK = "gpt-4o"      # More accurate for difficult images
 
+# Admission control for the analyze endpoints (per worker)
+ANALYZE_MAX_IN_FLIGHT = int(os.getenv("ANALYZE_MAX_IN_FLIGHT", "4"))
+ANALYZE_MAX_QUEUE = int(os.getenv("ANALYZE_MAX_QUEUE", "8"))
+ANALYZE_QUEUE_TIMEOUT_S = float(os.getenv("ANALYZE_QUEUE_TIMEOUT_S", "5"))
+ANALYZE_RETRY_AFTER_S = int(os.getenv("ANALYZE_RETRY_AFTER_S", "3"))
+
+# Per-user analyze quotas (sliding window, in memory, flushed to MongoDB in batches)
+QUOTA_FREE_PER_MINUTE = int(os.getenv("QUOTA_FREE_PER_MINUTE", "3"))
+QUOTA_FREE_PER_DAY = int(os.getenv("QUOTA_FREE_PER_DAY", "20"))
+QUOTA_PREMIUM_PER_MINUTE = int(os.getenv("QUOTA_PREMIUM_PER_MINUTE", "10"))
+QUOTA_PREMIUM_PER_DAY = int(os.getenv("QUOTA_PREMIUM_PER_DAY", "200"))
+QUOTA_FLUSH_INTERVAL_S = float(os.getenv("QUOTA_FLUSH_INTERVAL_S", "30"))
+
+# Model cascade: escalate low-confidence primary results to the fallback model
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "true").lower() == "true"
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.6"))
+CASCADE_MAX_QUESTIONS = int(os.getenv("CASCADE_MAX_QUESTIONS", "2"))
+CASCADE_LATENCY_BUDGET_S = float(os.getenv("CASCADE_LATENCY_BUDGET_S", "20"))
+CASCADE_SPECULATIVE = os.getenv("CASCADE_SPECULATIVE", "false").lower() == "true"
+CASCADE_DEFAULT_FALLBACK_S = float(os.getenv("CASCADE_DEFAULT_FALLBACK_S", "8"))  # expected fallback latency until enough samples exist
+
+# Hedged upstream requests: duplicate a slow vision call once it passes the tracked latency percentile
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_INITIAL_DELAY_S = float(os.getenv("HEDGE_INITIAL_DELAY_S", "12"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "2"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.05"))
+OPENAI_RPM_BUDGET = int(os.getenv("OPENAI_RPM_BUDGET", "500"))
+
+# End-to-end deadline for one analyze request (clients may shorten it with X-Client-Timeout-Ms)
+ANALYZE_DEADLINE_S = float(os.getenv("ANALYZE_DEADLINE_S", "45"))
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.5"))
+
+# Counted once per request that ends that way (see admit_and_analyze / run_until_disconnect)
+analyze_stats = {"cancelled_client_disconnect": 0, "deadline_exceeded": 0}
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """Seconds until the deadline, or 504 if it has already passed. None means no deadline."""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise HTTPException(status_code=504, detail="Food analysis deadline exceeded")
+    return remaining
+
 class FoodItem(BaseModel):
     name: str
     quantity_estimate: Dict[str, Any] = Field(default_factory=lambda: {"grams": 100, "range_grams": [80, 120]})
@@ -29,6 +143,8 @@ class FoodAnalyzeResponse(BaseModel):
     total: Dict[str, float] = Field(default_factory=lambda: {"calories_kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0})
     questions: List[str] = []
     notes: str = ""
+    analysis_id: Optional[str] = None
+    duplicate_match: bool = False
 
 # Legacy response model for backward compatibility
 class AnalyzeFoodRequest(BaseModel):
@@ -43,10 +159,31 @@ class AnalyzeFoodResponse(BaseModel):
     total_protein: float = 0
     total_carbs: float = 0
     total_fat: float = 0
+    analysis_id: Optional[str] = None
+    duplicate_match: bool = False
+
+class AnalyzeFeedbackRequest(BaseModel):
+    analysis_id: str
+    accepted: bool
+
+def compute_dhash(image) -> int:
+    """64-bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail."""
+    # Shrink first (reducing_gap box-reduces the bulk cheaply), then convert the tiny image
+    small = image.resize((9, 8), Image.Resampling.BILINEAR, reducing_gap=2.0).convert("L")
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
 
-def resize_image_base64(base64_str: str, max_size: int = 1280) -> str:
-    """Resize image to reduce payload size for API calls."""
+def resize_image_base64(base64_str: str, max_size: int = 1280) -> Tuple[str, Optional[int]]:
+    """Resize image to reduce payload size for API calls. Also returns the image's dHash (None if decoding failed)."""
     try:
+        load_pillow()
+        
         # Remove data URL prefix if present
         if base64_str.startswith("data:"):
             base64_str = base64_str.split(",", 1)[1]
@@ -66,34 +203,46 @@ def resize_image_base64(base64_str: str, max_size: int = 1280) -> str:
                 new_width = int(width * (max_size / height))
             image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
         
+        # Hash the downscaled image; hashing the full-resolution photo costs more than the resize
+        dhash = compute_dhash(image)
+        
         # Convert to JPEG with quality reduction
         buffer = io.BytesIO()
         if image.mode in ('RGBA', 'P'):
             image = image.convert('RGB')
         image.save(buffer, format='JPEG', quality=75)
         
-        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        return base64.b64encode(buffer.getvalue()).decode('utf-8'), dhash
     except Exception as e:
         logger.warning(f"Image resize failed: {e}, using original")
-        return base64_str
+        return base64_str, None
+
+def prepare_image(image_base64: str) -> Tuple[str, Optional[int]]:
+    """Resize the image and wrap it as a data URL for the vision API. Returns (image_url, dhash)."""
+    resized_base64, dhash = resize_image_base64(image_base64)
+    if not resized_base64.startswith("data:"):
+        return f"data:image/jpeg;base64,{resized_base64}", dhash
+    return resized_base64, dhash
 
-async def call_openai_vision(image_base64: str, locale: str = "tr-TR", use_fallback: bool = False) -> Dict[str, Any]:
-    """Call OpenAI Vision API to analyze food image."""
+async def call_openai_vision(image_base64: str, locale: str = "tr-TR", use_fallback: bool = False, image_url: Optional[str] = None, deadline: Optional[float] = None, retry_with_fallback: bool = True) -> Dict[str, Any]:
+    """
+    Call OpenAI Vision API to analyze food image.
+    The result carries the model that answered under "_model".
+    """
     
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=503, detail="OpenAI API key not configured (set OPENAI_KEY or OPENAI_API_KEY)")
     
+    if openai is None or Image is None:
+        # Import in a thread: a request that beats the warm-up must not stall the event loop
+        await asyncio.to_thread(load_vision_deps)
+    
     # Choose model
     model = VISION_MODEL_FALLBACK if use_fallback else VISION_MODEL_PRIMARY
     
-    # Resize image to reduce costs
-    resized_base64 = resize_image_base64(image_base64)
-    
-    # Prepare image URL
-    if not resized_base64.startswith("data:"):
-        image_url = f"data:image/jpeg;base64,{resized_base64}"
-    else:
-        image_url = resized_base64
+    # Resize image to reduce costs (skipped when the caller already prepared it)
+    if image_url is None:
+        image_url, _ = prepare_image(image_base64)
     
     # System prompt for structured food analysis
     system_prompt = """Sen bir yemek ve besin analiz uzmanısın. Fotoğraftaki yiyecekleri analiz et ve JSON formatında yanıt ver.
@@ -139,9 +288,10 @@ Her yiyeceği tespit et ve besin değerlerini tahmin et. Porsiyon büyüklüğü
 Kesin JSON formatında yanıt ver."""
 
     try:
-        client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+        client = get_openai_client()
         
-        response = await client.chat.completions.create(
+        completion = hedged_completion(
+            client,
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -163,27 +313,37 @@ Kesin JSON formatında yanıt ver."""
             temperature=0.3,
             response_format={"type": "json_object"}
         )
+        try:
+            response = await asyncio.wait_for(completion, time_left(deadline))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Food analysis deadline exceeded")
         
         # Parse response
         content = response.choices[0].message.content
         result = json.loads(content)
+        result["_model"] = model
         
         logger.info(f"OpenAI Vision analysis complete. Model: {model}, Items found: {len(result.get('items', []))}")
         return result
         
+    except HTTPException:
+        raise
+    
     except openai.RateLimitError as e:
         logger.error(f"OpenAI rate limit: {e}")
-        if not use_fallback:
+        if not use_fallback and retry_with_fallback:
             # Retry with fallback model
             logger.info("Retrying with fallback model...")
-            return await call_openai_vision(image_base64, locale, use_fallback=True)
+            time_left(deadline)  # no fallback retry once the deadline is gone
+            return await call_openai_vision(image_base64, locale, use_fallback=True, image_url=image_url, deadline=deadline)
         raise HTTPException(status_code=429, detail="API rate limit exceeded. Please try again later.")
     
     except openai.APIError as e:
         logger.error(f"OpenAI API error: {e}")
-        if not use_fallback:
+        if not use_fallback and retry_with_fallback:
             logger.info("Retrying with fallback model...")
-            return await call_openai_vision(image_base64, locale, use_fallback=True)
+            time_left(deadline)  # no fallback retry once the deadline is gone
+            return await call_openai_vision(image_base64, locale, use_fallback=True, image_url=image_url, deadline=deadline)
         raise HTTPException(status_code=502, detail="Food analysis service temporarily unavailable")
     
     except json.JSONDecodeError as e:
@@ -194,8 +354,935 @@ Kesin JSON formatında yanıt ver."""
         logger.error(f"Unexpected error in vision analysis: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+cascade_stats = {
+    "requests": 0,
+    "escalated": 0,
+    "escalation_failed": 0,
+    "budget_exhausted": 0,
+    "speculative_cancelled": 0,
+    "escalation_added_ms": 0.0
+}
+
+def needs_escalation(result: Dict[str, Any]) -> bool:
+    """Low item confidence or too many open questions means the primary model was unsure."""
+    # Same coercion as normalize_analysis: the raw model JSON may have odd shapes
+    if len(_strings(result.get("questions"))) >= CASCADE_MAX_QUESTIONS:
+        return True
+    items = [item for item in result.get("items") or [] if isinstance(item, dict)]
+    return any(_number(item.get("confidence"), 0) < CASCADE_MIN_CONFIDENCE for item in items)
+
+def expected_fallback_latency() -> float:
+    """Median fallback-model latency once enough samples exist, otherwise CASCADE_DEFAULT_FALLBACK_S."""
+    tracker = vision_latency.get(VISION_MODEL_FALLBACK)
+    if tracker is None or len(tracker.samples) < HEDGE_MIN_SAMPLES:
+        return CASCADE_DEFAULT_FALLBACK_S
+    return tracker.percentile(50)
+
+async def analyze_with_cascade(image_base64: str, locale: str = "tr-TR", deadline: Optional[float] = None, image_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run the primary model and escalate to the fallback model only when the
+    result is low-confidence and the remaining budget covers the expected
+    fallback latency.
+    With CASCADE_SPECULATIVE the fallback call starts alongside the primary,
+    doubles as the error fallback, and is cancelled as soon as the primary
+    result is good enough.
+    """
+    if image_url is None:
+        image_url, _ = prepare_image(image_base64)
+    time_left(deadline)
+
+    if not CASCADE_ENABLED:
+        result = await call_openai_vision(image_base64, locale, image_url=image_url, deadline=deadline)
+        result.pop("_model", None)
+        return result
+    started = time.monotonic()
+    cascade_stats["requests"] += 1
+
+    def start_fallback() -> asyncio.Task:
+        task = asyncio.create_task(call_openai_vision(image_base64, locale, use_fallback=True, image_url=image_url, deadline=deadline))
+        # Speculative calls may be abandoned; don't leave "exception never retrieved" warnings behind
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    fallback_task = start_fallback() if CASCADE_SPECULATIVE else None
+    fallback_started = time.monotonic()
+
+    try:
+        try:
+            # The speculative call already covers the error fallback, so don't start a second one
+            result = await call_openai_vision(
+                image_base64, locale, image_url=image_url, deadline=deadline,
+                retry_with_fallback=fallback_task is None
+            )
+        except HTTPException as e:
+            if fallback_task is None or e.status_code not in (429, 502):
+                raise
+            logger.info("Primary model failed, using the speculative fallback call")
+            result = await fallback_task
+
+        if result.pop("_model", VISION_MODEL_PRIMARY) == VISION_MODEL_FALLBACK or not needs_escalation(result):
+            if fallback_task is not None and not fallback_task.done():
+                cascade_stats["speculative_cancelled"] += 1
+            return result
+
+        remaining = CASCADE_LATENCY_BUDGET_S - (time.monotonic() - started)
+        if deadline is not None:
+            remaining = min(remaining, deadline - time.monotonic())
+        expected = expected_fallback_latency()
+        if fallback_task is not None:
+            expected -= time.monotonic() - fallback_started
+        if remaining <= 0 or remaining < expected:
+            cascade_stats["budget_exhausted"] += 1
+            return result
+
+        escalation_started = time.monotonic()
+        if fallback_task is None:
+            fallback_task = start_fallback()
+        try:
+            escalated = await asyncio.wait_for(fallback_task, remaining)
+        except (asyncio.TimeoutError, HTTPException) as e:
+            cascade_stats["escalation_failed"] += 1
+            logger.warning(f"Cascade escalation to {VISION_MODEL_FALLBACK} failed, keeping primary result: {e!r}")
+            return result
+
+        escalated.pop("_model", None)
+        added_ms = (time.monotonic() - escalation_started) * 1000
+        cascade_stats["escalated"] += 1
+        cascade_stats["escalation_added_ms"] += added_ms
+        logger.info(
+            f"Cascade escalated to {VISION_MODEL_FALLBACK} (+{added_ms:.0f} ms, "
+            f"rate {cascade_stats['escalated'] / cascade_stats['requests']:.1%})"
+        )
+        return escalated
+    finally:
+        if fallback_task is not None and not fallback_task.done():
+            fallback_task.cancel()
+
+def analyze_deadline(request: Request) -> float:
+    """Monotonic deadline for this request; the client's own timeout wins if it is shorter."""
+    budget = ANALYZE_DEADLINE_S
+    client_timeout_ms = request.headers.get("x-client-timeout-ms", "")
+    if client_timeout_ms.isdigit():
+        budget = min(budget, int(client_timeout_ms) / 1000)
+    return time.monotonic() + budget
+
+async def run_until_disconnect(request: Request, coro) -> Any:
+    """Await `coro`, cancelling it (and any upstream calls it started) if the client goes away."""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                analyze_stats["cancelled_client_disconnect"] += 1
+                logger.info("Client disconnected, cancelling food analysis")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+class AnalyzeAdmissionController:
+    """
+    Bounds concurrent food analyses per worker.
+    Up to `max_in_flight` analyses run at once; a short queue holds the rest
+    (premium users first) and anything beyond that is rejected with 503.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: List[list] = []  # heap of [priority, seq, future]
+        self._seq = itertools.count()
+
+    def _reject(self, reason: str) -> HTTPException:
+        self.rejected += 1
+        logger.warning(f"Food analyze shed ({reason}): in_flight={self.in_flight}, queued={len(self._waiters)}")
+        return HTTPException(
+            status_code=503,
+            detail="Food analysis is busy. Please try again shortly.",
+            headers={"Retry-After": str(ANALYZE_RETRY_AFTER_S)}
+        )
+
+    def _drop_waiter(self, entry: list) -> None:
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
+
+    async def acquire(self, premium: bool = False, deadline: Optional[float] = None) -> None:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue full")
+
+        # The queue wait is part of the request's deadline
+        timeout = self.queue_timeout
+        left = time_left(deadline)
+        deadline_bound = left is not None and left < timeout
+        if deadline_bound:
+            timeout = left
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = [0 if premium else 1, next(self._seq), fut]
+        heapq.heappush(self._waiters, entry)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            if fut.done():
+                return  # slot was handed over as the timeout fired
+            fut.cancel()
+            self._drop_waiter(entry)
+            if deadline_bound:
+                raise HTTPException(status_code=504, detail="Food analysis deadline exceeded")
+            raise self._reject("queue timeout")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            fut.cancel()
+            self._drop_waiter(entry)
+            raise
+
+    def release(self) -> None:
+        # Hand the slot straight to the next waiter so in_flight never dips and refills
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, premium: bool = False, deadline: Optional[float] = None):
+        await self.acquire(premium, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+analyze_admission = AnalyzeAdmissionController(
+    max_in_flight=ANALYZE_MAX_IN_FLIGHT,
+    max_queue=ANALYZE_MAX_QUEUE,
+    queue_timeout=ANALYZE_QUEUE_TIMEOUT_S
+)
+
+# Premium priority and quotas read the same User.is_premium field that
+# /api/premium/status reports; fail at import instead of treating everyone as free
+_user_fields = getattr(User, "model_fields", None) or getattr(User, "__fields__", {})
+if "is_premium" not in _user_fields:
+    raise RuntimeError("User model has no is_premium field; food analyze premium priority and quotas depend on it")
+
+def is_premium_user(user: User) -> bool:
+    """Same entitlement that /api/premium/status reports as is_premium."""
+    return bool(user.is_premium)
+
+class SlidingWindowCounter:
+    """
+    Approximate sliding window: the previous fixed window is weighted by how
+    much of it still overlaps the sliding window. O(1) time and memory.
+    """
+    __slots__ = ("window_s", "start", "current", "previous")
+
+    def __init__(self, window_s: int, start: float, current: int = 0, previous: int = 0):
+        self.window_s = window_s
+        self.start = start
+        self.current = current
+        self.previous = previous
+
+    def _roll(self, now: float) -> None:
+        elapsed = now - self.start
+        if elapsed >= self.window_s:
+            windows = int(elapsed // self.window_s)
+            self.previous = self.current if windows == 1 else 0
+            self.current = 0
+            self.start += windows * self.window_s
+
+    def count(self, now: float) -> float:
+        self._roll(now)
+        overlap = 1 - (now - self.start) / self.window_s
+        return self.previous * overlap + self.current
+
+    def seconds_until(self, now: float, target: float) -> float:
+        """Seconds until count() drops to `target` or below, assuming nothing new is counted."""
+        self._roll(now)
+        if target < 0:
+            return 2 * self.window_s
+        if self.current <= target:
+            if self.previous <= target - self.current:
+                return 0.0
+            # previous * (1 - (t - start) / w) + current <= target, solved for t
+            at = self.start + self.window_s * (1 - (target - self.current) / self.previous)
+        else:
+            # Not before the next window, where this window's count becomes `previous`
+            at = self.start + self.window_s * (2 - target / self.current)
+        return max(0.0, at - now)
+
+class AnalyzeQuotaTracker:
+    """
+    Per-user analyze quotas (per minute and per day).
+    Checks are pure in-memory. Each worker adds its day-count deltas to a
+    per-user, per-day document in MongoDB with $inc (batched by flush()),
+    and load() restores the combined counts at startup.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, tuple] = {}  # user_id -> (minute counter, day counter)
+        self._day_deltas: Dict[tuple, int] = {}  # (user_id, day_start) -> unflushed change
+
+    @staticmethod
+    def limits(premium: bool) -> tuple:
+        if premium:
+            return QUOTA_PREMIUM_PER_MINUTE, QUOTA_PREMIUM_PER_DAY
+        return QUOTA_FREE_PER_MINUTE, QUOTA_FREE_PER_DAY
+
+    def _counters(self, user_id: str, now: float) -> tuple:
+        counters = self._users.get(user_id)
+        if counters is None:
+            counters = (
+                SlidingWindowCounter(60, now - now % 60),
+                SlidingWindowCounter(86400, now - now % 86400)
+            )
+            self._users[user_id] = counters
+        return counters
+
+    def _usage(self, user_id: str, premium: bool, now: float) -> tuple:
+        minute, day = self._counters(user_id, now)
+        limit_minute, limit_day = self.limits(premium)
+        return minute, day, limit_minute - minute.count(now), limit_day - day.count(now)
+
+    def remaining(self, user_id: str, premium: bool = False) -> Dict[str, int]:
+        """Quota left for the user, without counting anything."""
+        _, _, left_minute, left_day = self._usage(user_id, premium, time.time())
+        return {"minute": max(0, int(left_minute)), "day": max(0, int(left_day))}
+
+    def check(self, user_id: str, premium: bool = False) -> Dict[str, int]:
+        """Raise 429 if either window is exhausted; otherwise return the quota left."""
+        now = time.time()
+        minute, day, left_minute, left_day = self._usage(user_id, premium, now)
+        if left_minute < 1 or left_day < 1:
+            limit_minute, limit_day = self.limits(premium)
+            retry_after = math.ceil(max(
+                minute.seconds_until(now, limit_minute - 1),
+                day.seconds_until(now, limit_day - 1)
+            )) + 1
+            raise HTTPException(
+                status_code=429,
+                detail="Food analysis quota exceeded. Please try again later.",
+                headers={
+                    "Retry-After": str(retry_after),
+                    **quota_headers({"minute": max(0, int(left_minute)), "day": max(0, int(left_day))})
+                }
+            )
+        return {"minute": int(left_minute), "day": int(left_day)}
+
+    def consume(self, user_id: str, premium: bool = False) -> Dict[str, int]:
+        """Count one upstream analysis for the user, or raise 429 if either window is exhausted."""
+        left = self.check(user_id, premium)
+        minute, day = self._users[user_id]
+        minute.current += 1
+        day.current += 1
+        key = (user_id, day.start)
+        self._day_deltas[key] = self._day_deltas.get(key, 0) + 1
+        return {"minute": left["minute"] - 1, "day": left["day"] - 1}
+
+    def refund(self, user_id: str) -> None:
+        """Give back one analysis that never produced an upstream answer."""
+        counters = self._users.get(user_id)
+        if counters is None:
+            return
+        now = time.time()
+        minute, day = counters
+        minute.count(now)  # roll windows first so a refund never lands in a newer window
+        day.count(now)
+        if minute.current > 0:
+            minute.current -= 1
+        if day.current > 0:
+            day.current -= 1
+            key = (user_id, day.start)
+            self._day_deltas[key] = self._day_deltas.get(key, 0) - 1
+
+    async def flush(self) -> None:
+        """Add pending day-count deltas in one bulk write and drop idle users from memory."""
+        now = time.time()
+        deltas, self._day_deltas = self._day_deltas, {}
+        ops = [
+            UpdateOne(
+                {"_id": f"{user_id}:{int(day_start)}"},
+                {"$inc": {"count": delta}, "$set": {
+                    "user_id": user_id,
+                    "day_start": day_start,
+                    "updated_at": now,
+                    # load() only reads today and yesterday; the TTL index removes older days
+                    "expires_at": datetime.fromtimestamp(day_start + 2 * 86400, timezone.utc)
+                }},
+                upsert=True
+            )
+            for (user_id, day_start), delta in deltas.items() if delta
+        ]
+
+        pending_users = {user_id for user_id, _ in deltas}
+        for user_id, (minute, day) in list(self._users.items()):
+            if user_id not in pending_users and minute.count(now) == 0 and day.count(now) == 0:
+                del self._users[user_id]
+
+        if not ops or mongo_db is None:
+            return
+        try:
+            await mongo_db.analyze_quotas.bulk_write(ops, ordered=False)
+        except Exception as e:
+            for key, delta in deltas.items():
+                self._day_deltas[key] = self._day_deltas.get(key, 0) + delta
+            logger.warning(f"Quota flush failed ({len(ops)} users): {e}")
+
+    async def ensure_indexes(self) -> None:
+        if mongo_db is None:
+            return
+        try:
+            await mongo_db.analyze_quotas.create_index("day_start")
+            await mongo_db.analyze_quotas.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Quota index creation failed: {e}")
+
+    async def load(self) -> None:
+        """Restore today's and yesterday's day counts (summed over all workers) so a restart does not reset quotas."""
+        if mongo_db is None:
+            return
+        now = time.time()
+        today = now - now % 86400
+        counts: Dict[str, Dict[float, int]] = {}
+        try:
+            async for doc in mongo_db.analyze_quotas.find({"day_start": {"$gte": today - 86400}}):
+                counts.setdefault(doc["user_id"], {})[doc["day_start"]] = doc.get("count", 0)
+        except Exception as e:
+            logger.warning(f"Quota load failed: {e}")
+            return
+        for user_id, days in counts.items():
+            self._users[user_id] = (
+                SlidingWindowCounter(60, now - now % 60),
+                SlidingWindowCounter(86400, today, days.get(today, 0), days.get(today - 86400, 0))
+            )
+        logger.info(f"Loaded analyze quotas for {len(counts)} users")
+
+analyze_quotas = AnalyzeQuotaTracker()
+
+def quota_headers(remaining: Dict[str, int]) -> Dict[str, str]:
+    return {
+        "X-Quota-Remaining-Minute": str(remaining["minute"]),
+        "X-Quota-Remaining-Day": str(remaining["day"])
+    }
+
+def with_quota_headers(exc: HTTPException, user_id: str, premium: bool) -> HTTPException:
+    """Attach the user's remaining quota to an error response (503, 499, 504, ...)."""
+    exc.headers = {**quota_headers(analyze_quotas.remaining(user_id, premium)), **(exc.headers or {})}
+    return exc
+
+_quota_flush_task: Optional[asyncio.Task] = None
+
+async def _flush_quotas_periodically():
+    while True:
+        await asyncio.sleep(QUOTA_FLUSH_INTERVAL_S)
+        await analyze_quotas.flush()
+
+@api_router.on_event("startup")
+async def start_quota_persistence():
+    global _quota_flush_task
+    # Router startup handlers can be run more than once when the router is included
+    if _quota_flush_task is not None:
+        return
+    started = time.perf_counter()
+    await analyze_quotas.ensure_indexes()
+    await analyze_quotas.load()
+    startup_timings["quota_load"] = (time.perf_counter() - started) * 1000
+    _quota_flush_task = asyncio.create_task(_flush_quotas_periodically())
+
+@api_router.on_event("shutdown")
+async def stop_quota_persistence():
+    global _quota_flush_task
+    # Same double-run guard as startup
+    if _quota_flush_task is None:
+        return
+    _quota_flush_task.cancel()
+    _quota_flush_task = None
+    await analyze_quotas.flush()
+
+class LatencyTracker:
+    """
+    Recent upstream latencies for one model; drives the hedge delay.
+    A primary that loses to its hedge is recorded with its elapsed time as a
+    lower bound, so the slow tail that hedging cuts off still counts.
+    """
+
+    def __init__(self, size: int = 200):
+        self.samples: deque = deque(maxlen=size)
+        self._sorted: Optional[List[float]] = None
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, p: float) -> float:
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * p / 100))
+        return self._sorted[index]
+
+    def hedge_delay(self) -> float:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY_S
+        return max(HEDGE_MIN_DELAY_S, self.percentile(HEDGE_PERCENTILE))
+
+vision_latency: Dict[str, LatencyTracker] = {}
+upstream_calls = SlidingWindowCounter(60, time.time() - time.time() % 60)
+hedge_stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "hedge_skipped_budget": 0}
+
+def _can_hedge() -> bool:
+    if not HEDGE_ENABLED:
+        return False
+    if hedge_stats["hedged"] >= hedge_stats["requests"] * HEDGE_MAX_RATIO:
+        return False
+    return upstream_calls.count(time.time()) < OPENAI_RPM_BUDGET
+
+async def _timed_completion(client, tracker: LatencyTracker, kwargs: Dict[str, Any]):
+    upstream_calls.count(time.time())  # roll the window before counting this call
+    upstream_calls.current += 1
+    started = time.monotonic()
+    response = await client.chat.completions.create(**kwargs)
+    tracker.record(time.monotonic() - started)
+    return response
+
+async def hedged_completion(client, **kwargs):
+    """
+    Send the completion request and, if it has not answered by the tracked
+    latency percentile, send one duplicate and use whichever finishes first.
+    Hedges are capped at HEDGE_MAX_RATIO of requests and count against the
+    upstream per-minute budget like any other call.
+    """
+    tracker = vision_latency.setdefault(kwargs["model"], LatencyTracker())
+    hedge_stats["requests"] += 1
+
+    primary = asyncio.create_task(_timed_completion(client, tracker, kwargs))
+    primary_started = time.monotonic()
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=tracker.hedge_delay())
+        if done:
+            return primary.result()
+        if not _can_hedge():
+            hedge_stats["hedge_skipped_budget"] += 1
+            return await primary
+
+        hedge_stats["hedged"] += 1
+        hedge = asyncio.create_task(_timed_completion(client, tracker, kwargs))
+        tasks.append(hedge)
+        logger.info(f"Hedging {kwargs['model']} request after {tracker.hedge_delay():.1f}s")
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        hedge_stats["hedge_won"] += 1
+                        if not primary.done():
+                            # The primary lost to its hedge: it took at least this long, so keep
+                            # the slow tail in the percentile. Other cancellations (deadlines,
+                            # disconnects, abandoned speculative calls) record nothing.
+                            tracker.record(time.monotonic() - primary_started)
+                    return task.result()
+        # Both attempts failed: surface the primary's error to the caller's handlers
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def warm_up_vision() -> None:
+    """
+    Preload what the first analyze request would otherwise pay for: the
+    openai/Pillow imports, the upstream client, the MongoDB pool and
+    Pillow's JPEG encoder. Each phase is timed into startup_timings.
+    """
+    # Startup handlers run before uvicorn binds its socket, so wait until the
+    # server is serving; the imports then run in a thread and don't block requests
+    await asyncio.sleep(VISION_WARMUP_DELAY_S)
+
+    async def phase(name: str, func) -> None:
+        started = time.perf_counter()
+        try:
+            result = func()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.warning(f"Warm-up phase {name} failed: {e}")
+        startup_timings[f"warmup_{name}"] = (time.perf_counter() - started) * 1000
+
+    def prime_jpeg_encoder():
+        Image.new("RGB", (8, 8)).save(io.BytesIO(), format="JPEG", quality=75)
+
+    await phase("vision_imports", lambda: asyncio.to_thread(load_vision_deps))
+    if OPENAI_API_KEY:
+        await phase("openai_client", get_openai_client)
+    if mongo_db is not None:
+        await phase("mongo_pool", lambda: mongo_db.command("ping"))
+    await phase("jpeg_encoder", prime_jpeg_encoder)
+
+    report = ", ".join(f"{name}={ms:.0f}ms" for name, ms in startup_timings.items())
+    logger.info(f"Startup report: {report}")
+
+_warmup_task: Optional[asyncio.Task] = None
+
+@api_router.on_event("startup")
+async def schedule_vision_warmup():
+    global _warmup_task
+    if VISION_WARMUP and _warmup_task is None:
+        _warmup_task = asyncio.create_task(warm_up_vision())
+
+@api_router.get("/debug/startup-report")
+async def startup_report():
+    return {
+        "phasesMs": {name: round(ms, 1) for name, ms in startup_timings.items()},
+        "visionDepsLoaded": openai is not None and Image is not None,
+        "warmupEnabled": VISION_WARMUP
+    }
+
+def camel_case_keys(stats: Dict[str, Any]) -> Dict[str, Any]:
+    return {re.sub(r"_([a-z])", lambda m: m.group(1).upper(), key): value for key, value in stats.items()}
+
+@api_router.get("/debug/analyze-stats")
+async def analyze_stats_report():
+    """Per-worker counters for the food analyze pipeline."""
+    return {
+        "admission": {
+            "inFlight": analyze_admission.in_flight,
+            "queued": len(analyze_admission._waiters),
+            "rejected": analyze_admission.rejected
+        },
+        "requests": camel_case_keys(analyze_stats),
+        "cascade": camel_case_keys(cascade_stats),
+        "hedge": camel_case_keys(hedge_stats),
+        "mealHash": meal_hashes.report()
+    }
+
+class MealHashStore:
+    """
+    Per-user perceptual hashes of recently confirmed analyses.
+    A new photo within MEAL_HASH_MAX_DISTANCE bits of a stored hash reuses
+    that analysis as a suggestion instead of calling the vision API.
+    Stores are capped at MEAL_HASH_MAX_PER_USER entries, so lookups are a
+    linear XOR/popcount scan. Users are loaded from MongoDB on demand and
+    kept in an LRU of MEAL_HASH_MAX_USERS per worker.
+    Analyses waiting for feedback live in meal_hash_pending (TTL
+    MEAL_HASH_PENDING_TTL_S) so any worker can take the confirmation.
+    """
+
+    def __init__(self):
+        self._users: OrderedDict = OrderedDict()  # user_id -> deque of (dhash, result), least recently used first
+        self._pending: OrderedDict = OrderedDict()  # analysis_id -> (user_id, dhash, result, duplicate), without MongoDB
+        self.stats = {"lookups": 0, "hits": 0, "confirmed_hits": 0, "false_matches": 0}
+
+    async def ensure_indexes(self) -> None:
+        if mongo_db is None:
+            return
+        try:
+            await mongo_db.meal_hashes.create_index([("user_id", 1), ("created_at", -1)])
+            await mongo_db.meal_hash_pending.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Meal hash index creation failed: {e}")
+
+    async def _entries(self, user_id: str) -> deque:
+        entries = self._users.get(user_id)
+        if entries is not None:
+            self._users.move_to_end(user_id)
+            return entries
+        entries = deque(maxlen=MEAL_HASH_MAX_PER_USER)
+        if mongo_db is not None:
+            try:
+                cursor = mongo_db.meal_hashes.find({"user_id": user_id}).sort("created_at", -1).limit(MEAL_HASH_MAX_PER_USER)
+                docs = [doc async for doc in cursor]
+                for doc in reversed(docs):
+                    entries.append((int(doc["dhash"], 16), doc["result"]))
+            except Exception as e:
+                logger.warning(f"Meal hash load failed for {user_id}: {e}")
+        self._users[user_id] = entries
+        while len(self._users) > MEAL_HASH_MAX_USERS:
+            self._users.popitem(last=False)
+        return entries
+
+    def report(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        answered = self.stats["confirmed_hits"] + self.stats["false_matches"]
+        return {
+            **camel_case_keys(self.stats),
+            "hitRate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "falseMatchRate": round(self.stats["false_matches"] / answered, 3) if answered else 0.0,
+            "cachedUsers": len(self._users)
+        }
+
+    async def match(self, user_id: str, dhash: int) -> Optional[Dict[str, Any]]:
+        self.stats["lookups"] += 1
+        best, best_distance = None, MEAL_HASH_MAX_DISTANCE + 1
+        for stored_hash, result in await self._entries(user_id):
+            distance = bin(stored_hash ^ dhash).count("1")
+            if distance < best_distance:
+                best, best_distance = result, distance
+        if best is not None:
+            self.stats["hits"] += 1
+        return best
+
+    def _track_locally(self, analysis_id: str, user_id: str, dhash: Optional[int], result: Dict[str, Any], duplicate: bool) -> None:
+        self._pending[analysis_id] = (user_id, dhash, result, duplicate)
+        while len(self._pending) > MEAL_HASH_PENDING_MAX:
+            self._pending.popitem(last=False)
+
+    async def track(self, user_id: str, dhash: Optional[int], result: Dict[str, Any], duplicate: bool) -> str:
+        """Remember an analysis until the user confirms or rejects it."""
+        analysis_id = uuid.uuid4().hex
+        if mongo_db is None:
+            self._track_locally(analysis_id, user_id, dhash, result, duplicate)
+            return analysis_id
+        try:
+            await mongo_db.meal_hash_pending.insert_one({
+                "_id": analysis_id,
+                "user_id": user_id,
+                "dhash": None if dhash is None else f"{dhash:016x}",
+                "result": result,
+                "duplicate": duplicate,
+                "expires_at": datetime.fromtimestamp(time.time() + MEAL_HASH_PENDING_TTL_S, timezone.utc)
+            })
+        except Exception as e:
+            logger.warning(f"Pending analysis save failed for {user_id}: {e}")
+            self._track_locally(analysis_id, user_id, dhash, result, duplicate)
+        return analysis_id
+
+    async def _take_pending(self, user_id: str, analysis_id: str) -> Optional[tuple]:
+        """Remove and return a pending analysis; taking it atomically means feedback is only counted once."""
+        pending = self._pending.get(analysis_id)
+        if pending is not None:
+            if pending[0] != user_id:
+                return None
+            del self._pending[analysis_id]
+            return pending
+        if mongo_db is None:
+            return None
+        doc = await mongo_db.meal_hash_pending.find_one_and_delete({"_id": analysis_id, "user_id": user_id})
+        if doc is None:
+            return None
+        dhash = None if doc.get("dhash") is None else int(doc["dhash"], 16)
+        return user_id, dhash, doc["result"], doc.get("duplicate", False)
+
+    async def _prune(self, user_id: str) -> None:
+        """Keep only the newest MEAL_HASH_MAX_PER_USER stored meals for the user, as in memory."""
+        cursor = mongo_db.meal_hashes.find({"user_id": user_id}, {"created_at": 1}).sort("created_at", -1).skip(MEAL_HASH_MAX_PER_USER).limit(1)
+        oldest_kept = [doc async for doc in cursor]
+        if oldest_kept:
+            await mongo_db.meal_hashes.delete_many({"user_id": user_id, "created_at": {"$lte": oldest_kept[0]["created_at"]}})
+
+    async def feedback(self, user_id: str, analysis_id: str, accepted: bool) -> bool:
+        pending = await self._take_pending(user_id, analysis_id)
+        if pending is None:
+            return False
+        _, dhash, result, duplicate = pending
+
+        if duplicate:
+            self.stats["confirmed_hits" if accepted else "false_matches"] += 1
+            return True
+        if not accepted or dhash is None:
+            return True
+
+        (await self._entries(user_id)).append((dhash, result))
+        if mongo_db is not None:
+            try:
+                await mongo_db.meal_hashes.insert_one({
+                    "user_id": user_id,
+                    "dhash": f"{dhash:016x}",
+                    "result": result,
+                    "created_at": datetime.now(timezone.utc)
+                })
+                await self._prune(user_id)
+            except Exception as e:
+                logger.warning(f"Meal hash save failed for {user_id}: {e}")
+        return True
+
+meal_hashes = MealHashStore()
+
+@api_router.on_event("startup")
+async def ensure_meal_hash_indexes():
+    # create_index is idempotent, so a second run of router startup handlers is harmless
+    await meal_hashes.ensure_indexes()
+
+DUPLICATE_MATCH_QUESTION = "Bu fotoğraf daha önce onayladığınız bir öğüne çok benziyor. Aynı yemek mi?"
+
+async def analyze_image(user_id: str, premium: bool, image_base64: str, locale: str, deadline: Optional[float]) -> Tuple[Dict[str, Any], str, bool, Dict[str, int]]:
+    """
+    Preprocess once, answer from the user's confirmed near-duplicates when
+    possible, otherwise run the vision cascade.
+    Quota is only charged for the cascade, and it is refunded if the request
+    is cancelled or hits its deadline before an upstream answer arrives.
+    Returns (result, analysis_id, duplicate_match, remaining_quota).
+    """
+    time_left(deadline)  # don't pay for a decode and resize the client will never see
+    image_url, dhash = await asyncio.to_thread(prepare_image, image_base64)
+    time_left(deadline)
+
+    if MEAL_HASH_ENABLED and dhash is not None:
+        stored = await meal_hashes.match(user_id, dhash)
+        if stored is not None:
+            result = {**stored, "questions": [DUPLICATE_MATCH_QUESTION] + _strings(stored.get("questions"))}
+            analysis_id = await meal_hashes.track(user_id, dhash, stored, duplicate=True)
+            return result, analysis_id, True, analyze_quotas.remaining(user_id, premium)
+
+    remaining = analyze_quotas.consume(user_id, premium=premium)
+    try:
+        result = await analyze_with_cascade(image_base64, locale, deadline=deadline, image_url=image_url)
+    except asyncio.CancelledError:
+        analyze_quotas.refund(user_id)
+        raise
+    except HTTPException as e:
+        if e.status_code == 504:
+            analyze_quotas.refund(user_id)
+        raise
+    return result, await meal_hashes.track(user_id, dhash, result, duplicate=False), False, remaining
+
+async def admit_and_analyze(user_id: str, premium: bool, image_base64: str, locale: str, deadline: Optional[float]) -> Tuple[Dict[str, Any], str, bool, Dict[str, int]]:
+    """
+    Wait for an admission slot (bounded by the deadline), then analyze.
+    Endpoints run this under run_until_disconnect, so a client that gives
+    up while queued is noticed as well.
+    """
+    try:
+        async with analyze_admission.slot(premium=premium, deadline=deadline):
+            return await analyze_image(user_id, premium, image_base64, locale, deadline)
+    except HTTPException as e:
+        # Only deadlines that fail the request count; an escalation cut short still returns the primary result
+        if e.status_code == 504:
+            analyze_stats["deadline_exceeded"] += 1
+        raise
+
+@api_router.post("/food/analyze/feedback")
+async def analyze_feedback(request_data: AnalyzeFeedbackRequest, current_user: Optional[User] = Depends(get_current_user)):
+    """
+    Confirm or reject an analysis. Confirmed results become reusable
+    matches for the user's future photos; rejected duplicate suggestions
+    count as false matches.
+    """
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if not await meal_hashes.feedback(current_user.user_id, request_data.analysis_id, request_data.accepted):
+        raise HTTPException(status_code=404, detail="Analysis not found or expired")
+    return {"status": "ok"}
+
+def _number(value: Any, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _strings(value: Any) -> List[str]:
+    """Model text fields may come back as a string or a list of strings; always return a flat list."""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [text for part in value for text in _strings(part)]
+    return [str(value)]
+
+def _mapping(value: Any) -> Dict[str, Any]:
+    return value if isinstance(value, dict) else {}
+
+def normalize_analysis(result: Dict[str, Any], analysis_id: Optional[str] = None, duplicate: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Turn raw model JSON into the legacy (/food/analyze) and v2
+    (/food/analyze/v2) response bodies in a single pass over the items.
+    Values are coerced here to the declared response models, so the bodies
+    are sent as-is without another round of Pydantic validation.
+    """
+    legacy_items = []
+    v2_items = []
+    total_calories = total_protein = total_carbs = total_fat = 0.0
+    low_confidence = False
+
+    for item in result.get("items") or []:
+        if not isinstance(item, dict):
+            continue
+        qty = _mapping(item.get("quantity_estimate"))
+        raw_macros = _mapping(item.get("macros"))
+        macros = {key: _number(value) for key, value in raw_macros.items()}
+        name = str(item.get("name") or "Bilinmeyen yemek")
+        calories = _number(item.get("calories_kcal", 0))
+        protein = macros.get("protein_g", 0.0)
+        carbs = macros.get("carbs_g", 0.0)
+        fat = macros.get("fat_g", 0.0)
+        raw_confidence = item.get("confidence")
+        confidence = _number(raw_confidence, 0.7)
+
+        total_calories += calories
+        total_protein += protein
+        total_carbs += carbs
+        total_fat += fat
+        if raw_confidence is None or confidence < 0.7:
+            low_confidence = True
+
+        legacy_items.append({
+            "label": name,
+            "aliases": [],
+            "portion": {
+                "estimate_g": qty.get("grams", 100),
+                "range_g": qty.get("range_grams", [80, 120]),
+                "basis": "visual"
+            },
+            # Legacy items pass the model's values through unchanged, as before
+            "confidence": item.get("confidence", 0.7),
+            "food_id": None,  # Not from database
+            "calories": item.get("calories_kcal", 0),
+            "protein": raw_macros.get("protein_g", 0),
+            "carbs": raw_macros.get("carbs_g", 0),
+            "fat": raw_macros.get("fat_g", 0)
+        })
+        v2_items.append({
+            "name": name,
+            "quantity_estimate": qty or {"grams": 100, "range_grams": [80, 120]},
+            "calories_kcal": int(calories),
+            "macros": macros or {"protein_g": 0.0, "carbs_g": 0.0, "fat_g": 0.0},
+            "confidence": confidence
+        })
+
+    questions = _strings(result.get("questions"))
+    notes = _strings(result.get("notes"))
+
+    notes_list = notes + questions
+
+    legacy = {
+        "items": legacy_items,
+        "notes": notes_list,
+        "needs_user_confirmation": len(questions) > 0 or low_confidence,
+        "total_calories": int(total_calories),
+        "total_protein": round(total_protein, 1),
+        "total_carbs": round(total_carbs, 1),
+        "total_fat": round(total_fat, 1),
+        "analysis_id": analysis_id,
+        "duplicate_match": duplicate
+    }
+    total = _mapping(result.get("total")) or {"calories_kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0}
+    v2 = {
+        "items": v2_items,
+        "total": {key: _number(value) for key, value in total.items()},
+        "questions": questions,
+        "notes": " ".join(notes),
+        "analysis_id": analysis_id,
+        "duplicate_match": duplicate
+    }
+    return legacy, v2
+
 @api_router.post("/food/analyze", response_model=AnalyzeFoodResponse)
-async def analyze_food(request_data: AnalyzeFoodRequest, current_user: Optional[User] = Depends(get_current_user)):
+async def analyze_food(request_data: AnalyzeFoodRequest, request: Request, current_user: Optional[User] = Depends(get_current_user)):
     """
     Analyze food image using OpenAI Vision API.
     Returns detected food items with calorie and macro estimates.
@@ -206,72 +1293,34 @@ async def analyze_food(request_data: AnalyzeFoodRequest, current_user: Optional[
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=503, detail="OpenAI API key not configured. Set OPENAI_KEY environment variable.")
     
+    deadline = analyze_deadline(request)
+    premium = is_premium_user(current_user)
+    # Reject exhausted users before they take a queue slot; the charge itself happens in analyze_image
+    analyze_quotas.check(current_user.user_id, premium=premium)
+    
     try:
-        # Call OpenAI Vision
-        result = await call_openai_vision(
+        # Call OpenAI Vision (queued behind the per-worker admission controller)
+        result, analysis_id, duplicate, remaining = await run_until_disconnect(request, admit_and_analyze(
+            user_id=current_user.user_id,
+            premium=premium,
             image_base64=request_data.image_base64,
-            locale=request_data.locale
-        )
-        
-        # Transform to legacy response format for frontend compatibility
-        items = result.get("items", [])
-        questions = result.get("questions", [])
-        notes = result.get("notes", "")
+            locale=request_data.locale,
+            deadline=deadline
+        ))
         
-        # Calculate totals
-        total_calories = sum(item.get("calories_kcal", 0) for item in items)
-        total_protein = sum(item.get("macros", {}).get("protein_g", 0) for item in items)
-        total_carbs = sum(item.get("macros", {}).get("carbs_g", 0) for item in items)
-        total_fat = sum(item.get("macros", {}).get("fat_g", 0) for item in items)
+        # Legacy response format for frontend compatibility
+        legacy, _ = normalize_analysis(result, analysis_id, duplicate)
+        return FastJSONResponse(content=legacy, headers=quota_headers(remaining))
         
-        # Transform items to frontend expected format
-        transformed_items = []
-        for item in items:
-            qty = item.get("quantity_estimate", {})
-            macros = item.get("macros", {})
-            
-            transformed_items.append({
-                "label": item.get("name", "Bilinmeyen yemek"),
-                "aliases": [],
-                "portion": {
-                    "estimate_g": qty.get("grams", 100),
-                    "range_g": qty.get("range_grams", [80, 120]),
-                    "basis": "visual"
-                },
-                "confidence": item.get("confidence", 0.7),
-                "food_id": None,  # Not from database
-                "calories": item.get("calories_kcal", 0),
-                "protein": macros.get("protein_g", 0),
-                "carbs": macros.get("carbs_g", 0),
-                "fat": macros.get("fat_g", 0)
-            })
-        
-        # Build notes list
-        notes_list = []
-        if notes:
-            notes_list.append(notes)
-        if questions:
-            notes_list.extend(questions)
-        
-        return AnalyzeFoodResponse(
-            items=transformed_items,
-            notes=notes_list,
-            needs_user_confirmation=len(questions) > 0 or any(item.get("confidence", 0) < 0.7 for item in items),
-            total_calories=int(total_calories),
-            total_protein=round(total_protein, 1),
-            total_carbs=round(total_carbs, 1),
-            total_fat=round(total_fat, 1)
-        )
-        
-    except HTTPException:
-        raise
+    except HTTPException as e:
+        raise with_quota_headers(e, current_user.user_id, premium)
     except Exception as e:
         logger.error(f"Food analyze error: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 # New endpoint with cleaner response format
 @api_router.post("/food/analyze/v2", response_model=FoodAnalyzeResponse)
-async def analyze_food_v2(request_data: FoodAnalyzeRequest, current_user: Optional[User] = Depends(get_current_user)):
+async def analyze_food_v2(request_data: FoodAnalyzeRequest, request: Request, current_user: Optional[User] = Depends(get_current_user)):
     """
     Analyze food image using OpenAI Vision API (v2 with cleaner response).
     Returns detected food items with calorie and macro estimates.
@@ -282,25 +1331,31 @@ async def analyze_food_v2(request_data: FoodAnalyzeRequest, current_user: Option
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=503, detail="OpenAI API key not configured")
     
+    deadline = analyze_deadline(request)
+    premium = is_premium_user(current_user)
+    # Reject exhausted users before they take a queue slot; the charge itself happens in analyze_image
+    analyze_quotas.check(current_user.user_id, premium=premium)
+    
     try:
-        result = await call_openai_vision(
+        result, analysis_id, duplicate, remaining = await run_until_disconnect(request, admit_and_analyze(
+            user_id=current_user.user_id,
+            premium=premium,
             image_base64=request_data.image_base64,
-            locale=request_data.locale
-        )
+            locale=request_data.locale,
+            deadline=deadline
+        ))
         
-        return FoodAnalyzeResponse(
-            items=[FoodItem(**item) for item in result.get("items", [])],
-            total=result.get("total", {"calories_kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0}),
-            questions=result.get("questions", []),
-            notes=result.get("notes", "")
-        )
+        _, v2 = normalize_analysis(result, analysis_id, duplicate)
+        return FastJSONResponse(content=v2, headers=quota_headers(remaining))
         
-    except HTTPException:
-        raise
+    except HTTPException as e:
+        raise with_quota_headers(e, current_user.user_id, premium)
     except Exception as e:
         logger.error(f"Food analyze v2 error: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+startup_timings["food_analyze_module"] = (time.perf_counter() - _food_analyze_import_started) * 1000
+
 
 # -------------------------
 # WATER TRACKING
@@ -261,6 +261,39 @@ class CalorieDietAPITester:
         except Exception as e:
             self.log_test("Daily Summary", False, f"Exception: {str(e)}")
     
+    def test_analyze_feedback(self):
+        """Test POST /api/food/analyze/feedback - Auth required, unknown analysis_id rejected"""
+        payload = {"analysis_id": "does-not-exist", "accepted": True}
+        
+        try:
+            response = requests.post(f"{BACKEND_URL}/food/analyze/feedback", json=payload, 
+                                   headers={"Content-Type": "application/json"}, timeout=30)
+            
+            if response.status_code == 401:
+                self.log_test("Analyze Feedback (no auth)", True, "Unauthenticated request rejected with 401")
+            else:
+                self.log_test("Analyze Feedback (no auth)", False, 
+                            f"Expected 401, got HTTP {response.status_code}: {response.text}")
+                
+        except Exception as e:
+            self.log_test("Analyze Feedback (no auth)", False, f"Exception: {str(e)}")
+        
+        if not self.session_token:
+            self.log_test("Analyze Feedback (unknown id)", False, "No session token available")
+            return
+            
+        try:
+            response = self.make_request("POST", "/food/analyze/feedback", payload)
+            
+            if response.status_code == 404:
+                self.log_test("Analyze Feedback (unknown id)", True, "Unknown analysis_id rejected with 404")
+            else:
+                self.log_test("Analyze Feedback (unknown id)", False, 
+                            f"Expected 404, got HTTP {response.status_code}: {response.text}")
+                
+        except Exception as e:
+            self.log_test("Analyze Feedback (unknown id)", False, f"Exception: {str(e)}")
+    
     def test_add_water(self):
         """Test POST /api/water/add - Add water intake"""
         if not self.session_token:
@@ -514,6 +547,52 @@ class CalorieDietAPITester:
         except Exception as e:
             self.log_test("Storage Status", False, f"Exception: {str(e)}")
     
+    def test_startup_report(self):
+        """Test GET /api/debug/startup-report - Get startup phase timings"""
+        try:
+            response = self.make_request("GET", "/debug/startup-report")
+            
+            if response.status_code == 200:
+                data = response.json()
+                required_fields = ["phasesMs", "visionDepsLoaded", "warmupEnabled"]
+                
+                if all(field in data for field in required_fields):
+                    self.log_test("Startup Report", True, 
+                                f"Phases: {', '.join(data['phasesMs'])}", data)
+                else:
+                    missing = [f for f in required_fields if f not in data]
+                    self.log_test("Startup Report", False, 
+                                f"Missing fields: {missing}", data)
+            else:
+                self.log_test("Startup Report", False, 
+                            f"HTTP {response.status_code}: {response.text}")
+                
+        except Exception as e:
+            self.log_test("Startup Report", False, f"Exception: {str(e)}")
+    
+    def test_analyze_stats(self):
+        """Test GET /api/debug/analyze-stats - Get food analyze pipeline counters"""
+        try:
+            response = self.make_request("GET", "/debug/analyze-stats")
+            
+            if response.status_code == 200:
+                data = response.json()
+                required_fields = ["admission", "requests", "cascade", "hedge"]
+                
+                if all(field in data for field in required_fields):
+                    self.log_test("Analyze Stats", True, 
+                                f"In flight: {data['admission'].get('inFlight')}", data)
+                else:
+                    missing = [f for f in required_fields if f not in data]
+                    self.log_test("Analyze Stats", False, 
+                                f"Missing fields: {missing}", data)
+            else:
+                self.log_test("Analyze Stats", False, 
+                            f"HTTP {response.status_code}: {response.text}")
+                
+        except Exception as e:
+            self.log_test("Analyze Stats", False, f"Exception: {str(e)}")
+    
     def run_all_tests(self):
         """Run all API tests in sequence"""
         print(f"🚀 Starting CalorieDiet Backend API Tests")
@@ -530,6 +609,7 @@ class CalorieDietAPITester:
         self.test_add_meal()
         self.test_get_today_meals()
         self.test_daily_summary()
+        self.test_analyze_feedback()
         
         # Water tracking tests
         self.test_add_water()
@@ -548,6 +628,8 @@ class CalorieDietAPITester:
         # Premium/Status tests
         self.test_premium_status()
         self.test_storage_status()
+        self.test_startup_report()
+        self.test_analyze_stats()
         
         # Summary
         print("=" * 60)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the food analyze response path.
+Compares per-response CPU time of the previous serialization (item-by-item
+dicts, Pydantic response models, then FastAPI's response_model validation and
+JSON serialization) with normalize_analysis() + FastJSONResponse.
+
+Run from the repository root: python bench_analyze_serialization.py
+Needs the backend requirements (fastapi, pydantic, pymongo; orjson for the
+fast path). Uses backend/server.py when present, otherwise FOOD_ANALYZE_CODE.py.
+"""
+
+import base64
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field, TypeAdapter
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def load_food_analyze() -> Dict[str, Any]:
+    """
+    The food analyze section lives in backend/server.py in the full app.
+    This repository carries it as FOOD_ANALYZE_CODE.py, which relies on the
+    names server.py defines before it, so those are provided here.
+    """
+    if os.path.exists(os.path.join(ROOT, "backend", "server.py")):
+        sys.path.insert(0, os.path.join(ROOT, "backend"))
+        import server
+        return vars(server)
+
+    class User(BaseModel):
+        user_id: str
+        is_premium: bool = False
+
+    async def get_current_user() -> Optional[User]:
+        return None
+
+    namespace = {
+        "os": os, "base64": base64, "json": json,
+        "Dict": Dict, "Any": Any, "List": List, "Optional": Optional,
+        "BaseModel": BaseModel, "Field": Field,
+        "HTTPException": HTTPException, "Depends": Depends,
+        "api_router": APIRouter(), "User": User, "get_current_user": get_current_user,
+        "logger": logging.getLogger("food_analyze"), "mongo_db": None
+    }
+    path = os.path.join(ROOT, "FOOD_ANALYZE_CODE.py")
+    with open(path, encoding="utf-8") as f:
+        source = f.read().split("# -------------------------\n# WATER TRACKING")[0]
+    exec(compile(source, path, "exec"), namespace)
+    return namespace
+
+food_analyze = load_food_analyze()
+AnalyzeFoodResponse = food_analyze["AnalyzeFoodResponse"]
+FoodAnalyzeResponse = food_analyze["FoodAnalyzeResponse"]
+FoodItem = food_analyze["FoodItem"]
+FastJSONResponse = food_analyze["FastJSONResponse"]
+normalize_analysis = food_analyze["normalize_analysis"]
+
+ITERATIONS = 5000
+
+# Typical gpt-4o-mini answer for a Turkish breakfast plate
+SAMPLE_RESULT = {
+    "items": [
+        {
+            "name": name,
+            "quantity_estimate": {"grams": grams, "range_grams": [grams - 30, grams + 30]},
+            "calories_kcal": calories,
+            "macros": {"protein_g": protein, "carbs_g": carbs, "fat_g": fat},
+            "confidence": confidence
+        }
+        for name, grams, calories, protein, carbs, fat, confidence in [
+            ("Menemen", 200, 240, 12.5, 9.0, 17.0, 0.86),
+            ("Beyaz peynir", 60, 160, 10.0, 1.0, 13.0, 0.81),
+            ("Siyah zeytin", 30, 90, 0.5, 1.5, 9.0, 0.74),
+            ("Simit", 100, 280, 9.0, 52.0, 4.0, 0.91),
+            ("Domates", 80, 15, 0.7, 3.1, 0.2, 0.65)
+        ]
+    ],
+    "total": {"calories_kcal": 785, "protein_g": 32.7, "carbs_g": 66.6, "fat_g": 43.2},
+    "questions": ["Menemende sucuk var mı?"],
+    "notes": "Porsiyonlar tabak boyutuna göre tahmin edildi."
+}
+
+RESPONSE_ADAPTERS = {model_cls: TypeAdapter(model_cls) for model_cls in (AnalyzeFoodResponse, FoodAnalyzeResponse)}
+
+def serialize_response(model_cls, model) -> bytes:
+    """
+    What FastAPI does with a returned model under response_model and the
+    default response class (fastapi.routing.serialize_response with
+    dump_json): validate it against the response model, then dump JSON
+    bytes in pydantic-core.
+    """
+    adapter = RESPONSE_ADAPTERS[model_cls]
+    value = adapter.validate_python(model, from_attributes=True)
+    return adapter.dump_json(value, by_alias=True)
+
+def legacy_before(result):
+    """Previous /food/analyze path."""
+    items = result.get("items", [])
+    questions = result.get("questions", [])
+    notes = result.get("notes", "")
+
+    total_calories = sum(item.get("calories_kcal", 0) for item in items)
+    total_protein = sum(item.get("macros", {}).get("protein_g", 0) for item in items)
+    total_carbs = sum(item.get("macros", {}).get("carbs_g", 0) for item in items)
+    total_fat = sum(item.get("macros", {}).get("fat_g", 0) for item in items)
+
+    transformed_items = []
+    for item in items:
+        qty = item.get("quantity_estimate", {})
+        macros = item.get("macros", {})
+        transformed_items.append({
+            "label": item.get("name", "Bilinmeyen yemek"),
+            "aliases": [],
+            "portion": {
+                "estimate_g": qty.get("grams", 100),
+                "range_g": qty.get("range_grams", [80, 120]),
+                "basis": "visual"
+            },
+            "confidence": item.get("confidence", 0.7),
+            "food_id": None,
+            "calories": item.get("calories_kcal", 0),
+            "protein": macros.get("protein_g", 0),
+            "carbs": macros.get("carbs_g", 0),
+            "fat": macros.get("fat_g", 0)
+        })
+
+    notes_list = []
+    if notes:
+        notes_list.append(notes)
+    if questions:
+        notes_list.extend(questions)
+
+    model = AnalyzeFoodResponse(
+        items=transformed_items,
+        notes=notes_list,
+        needs_user_confirmation=len(questions) > 0 or any(item.get("confidence", 0) < 0.7 for item in items),
+        total_calories=int(total_calories),
+        total_protein=round(total_protein, 1),
+        total_carbs=round(total_carbs, 1),
+        total_fat=round(total_fat, 1)
+    )
+    return serialize_response(AnalyzeFoodResponse, model)
+
+def v2_before(result):
+    """Previous /food/analyze/v2 path."""
+    model = FoodAnalyzeResponse(
+        items=[FoodItem(**item) for item in result.get("items", [])],
+        total=result.get("total", {"calories_kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0}),
+        questions=result.get("questions", []),
+        notes=result.get("notes", "")
+    )
+    return serialize_response(FoodAnalyzeResponse, model)
+
+def legacy_after(result):
+    legacy, _ = normalize_analysis(result)
+    return FastJSONResponse(content=legacy).body
+
+def v2_after(result):
+    _, v2 = normalize_analysis(result)
+    return FastJSONResponse(content=v2).body
+
+def cpu_us_per_call(func) -> float:
+    for _ in range(200):
+        func(SAMPLE_RESULT)
+    started = time.process_time()
+    for _ in range(ITERATIONS):
+        func(SAMPLE_RESULT)
+    return (time.process_time() - started) / ITERATIONS * 1_000_000
+
+if __name__ == "__main__":
+    print(f"Response class: {FastJSONResponse.__name__}, {ITERATIONS} iterations, {len(SAMPLE_RESULT['items'])} items")
+    for label, before, after in [("legacy", legacy_before, legacy_after), ("v2", v2_before, v2_after)]:
+        before_us = cpu_us_per_call(before)
+        after_us = cpu_us_per_call(after)
+        print(f"{label:>6}: before {before_us:7.1f} us  after {after_us:7.1f} us  ({before_us / after_us:.1f}x)")